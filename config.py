@@ -4,12 +4,25 @@ import os
 # Bot Token from environment variable
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 
+# Webhook mode, needs both URL and secret (otherwise polling is used).
+# The listener binds PORT, so run as a web process, not a worker.
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+PORT = int(os.environ.get('PORT', 8080))
+
+# Helper bot tokens (space separated) for spreading large uploads
+HELPER_TOKENS = os.environ.get('HELPER_TOKENS', '').split()
+# Chat the helper bots upload into; the main bot copies from here
+LEECH_DUMP_CHAT = os.environ.get('LEECH_DUMP_CHAT')
+HELPER_UPLOAD_MIN_MB = 20
+
 # Download folder
 DOWNLOAD_FOLDER = os.path.join(os.getcwd(), "downloads")
 
 # Telegram limits
 TELEGRAM_FILE_LIMIT_MB = 50
 TARGET_COMPRESSED_SIZE_MB = 45
+NVENC_TARGET_COMPRESSED_SIZE_MB = 42  # NVENC output runs larger
 MAX_DOWNLOAD_SIZE_MB = None
 DOWNLOAD_TIMEOUT = 600
 FFMPEG_PATH = "ffmpeg"
@@ -1,17 +1,27 @@
 # main.py
 import os
 import asyncio
+import glob
+import io
+import json
 import logging
 import re
 import subprocess
+import time
+import uuid
+from pathlib import Path
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.request import HTTPXRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 import yt_dlp
+from cachetools import TTLCache
 from config import (
     BOT_TOKEN, DOWNLOAD_FOLDER, TELEGRAM_FILE_LIMIT_MB, 
-    TARGET_COMPRESSED_SIZE_MB, MAX_DOWNLOAD_SIZE_MB, 
-    DOWNLOAD_TIMEOUT, FFMPEG_PATH
+    TARGET_COMPRESSED_SIZE_MB, NVENC_TARGET_COMPRESSED_SIZE_MB, 
+    MAX_DOWNLOAD_SIZE_MB, DOWNLOAD_TIMEOUT, FFMPEG_PATH,
+    HELPER_TOKENS, LEECH_DUMP_CHAT, HELPER_UPLOAD_MIN_MB,
+    WEBHOOK_URL, WEBHOOK_SECRET, PORT
 )
 
 # Logging setup
@@ -21,12 +31,125 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Store video info temporarily
-user_video_info = {}
+# Store video info temporarily (bounded, entries expire after 10 minutes)
+user_video_info = TTLCache(maxsize=256, ttl=600)
+
+# Bulky yt-dlp info keys the download doesn't need, dropped before caching
+INFO_DROP_KEYS = {
+    'automatic_captions', 'subtitles', 'requested_subtitles',
+    'thumbnails', 'heatmap', 'chapters', 'description'
+}
+
+# Video ID from watch, shorts, embed, live and youtu.be links
+YT_RE = re.compile(
+    r'(?:youtube\.com/(?:watch\?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})'
+)
+
+
+def get_cpu_budget():
+    """Number of CPUs this process may actually use (affinity and cgroup quota)"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    
+    # cgroup v2 quota, e.g. "200000 100000" = 2 CPUs, "max 100000" = unlimited
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    
+    return cpus
+
+
+# Concurrent encodes and threads per encode, together capped to the
+# container's CPU budget (this also bounds piped output held in memory)
+CPU_BUDGET = get_cpu_budget()
+ENCODE_SLOTS = max(1, CPU_BUDGET // 2)
+FFMPEG_THREADS = max(1, CPU_BUDGET // ENCODE_SLOTS)
+encode_semaphore = asyncio.Semaphore(ENCODE_SLOTS)
+
+# Hardware H.264 encoders in order of preference
+HW_ENCODERS = ['h264_nvenc', 'h264_qsv', 'h264_vaapi', 'h264_videotoolbox']
+
+# Detected hardware encoder (set once at startup)
+HW_ENCODER = None
+
+# Helper bots for spreading large uploads (set up at startup)
+helper_bots = []
+helper_loads = {}
+
+
+def detect_hw_encoder():
+    """Find a usable hardware H.264 encoder, or None for libx264"""
+    try:
+        result = subprocess.run(
+            [FFMPEG_PATH, '-hide_banner', '-encoders'],
+            capture_output=True, text=True, timeout=10
+        )
+        listed = [enc for enc in HW_ENCODERS if enc in result.stdout]
+        
+        # ffmpeg builds often list encoders without the hardware present,
+        # so confirm each one with a tiny test encode
+        for encoder in listed:
+            input_args, video_args = hw_encoder_args(encoder, 1000)
+            cmd = [
+                FFMPEG_PATH, '-hide_banner',
+                *input_args,
+                '-f', 'lavfi', '-i', 'nullsrc=s=256x256:d=1',
+                '-frames:v', '1',
+                *video_args,
+                '-f', 'null', os.devnull
+            ]
+            test = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+            if test.returncode == 0:
+                return encoder
+    except Exception as e:
+        logger.error(f"Error detecting hardware encoder: {e}")
+    return None
+
+
+def hw_encoder_args(encoder, bitrate):
+    """Return (input args, video args) for a hardware encoder at bitrate kbps"""
+    if encoder == 'h264_nvenc':
+        return [], [
+            '-c:v', encoder,
+            '-b:v', f'{bitrate}k',
+            '-maxrate', f'{bitrate}k',
+            '-bufsize', f'{bitrate * 2}k',
+            '-rc', 'cbr'
+        ]
+    if encoder == 'h264_qsv':
+        return [], [
+            '-c:v', encoder,
+            '-b:v', f'{bitrate}k',
+            '-maxrate', f'{bitrate}k'
+        ]
+    if encoder == 'h264_vaapi':
+        return ['-vaapi_device', '/dev/dri/renderD128'], [
+            '-vf', 'format=nv12,hwupload',
+            '-c:v', encoder,
+            '-b:v', f'{bitrate}k',
+            '-maxrate', f'{bitrate}k'
+        ]
+    if encoder == 'h264_videotoolbox':
+        return [], [
+            '-c:v', encoder,
+            '-b:v', f'{bitrate}k',
+            '-allow_sw', '1'
+        ]
+    raise ValueError(f"Unknown encoder: {encoder}")
 
 
 def clean_youtube_url(url):
     """Clean YouTube URL by removing tracking parameters"""
+    # Fast path: nothing to strip (plain video links are handled by YT_RE)
+    if '?' not in url:
+        return url
+    
     try:
         parsed = urlparse(url)
         params = parse_qs(parsed.query)
@@ -53,35 +176,80 @@ def clean_youtube_url(url):
         return url
 
 
-def get_video_duration(file_path):
+async def run_command(cmd, timeout, text=True):
+    """
+    Run a subprocess without blocking the event loop, return (returncode, stdout, stderr)
+    
+    With text=False stdout is returned as raw bytes
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+    finally:
+        # Timeout or cancelled handler: don't leave ffmpeg running as an orphan
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+    if text:
+        stdout = stdout.decode(errors='replace')
+    return proc.returncode, stdout, stderr.decode(errors='replace')
+
+
+async def probe(path):
+    """Get duration, bitrate and codec info for a file with a single ffprobe run"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-print_format', 'json',
+        '-show_format', '-show_streams',
+        path
+    ]
+    returncode, stdout, stderr = await run_command(cmd, timeout=10)
+    if returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {stderr.strip()}")
+    return json.loads(stdout)
+
+
+async def get_video_duration(file_path):
     """Get video duration in seconds using FFmpeg"""
     try:
-        cmd = [
-            'ffprobe', '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            file_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-        duration = float(result.stdout.strip())
+        info = await probe(file_path)
+        duration = float(info['format']['duration'])
         return duration
     except Exception as e:
         logger.error(f"Error getting duration: {e}")
         return None
 
 
-def compress_video(input_path, output_path, target_size_mb):
+async def compress_video(input_path, input_size_mb, target_size_mb, duration=None):
     """
-    Compress video to target size using FFmpeg
+    Compress video to target size using FFmpeg, return the MP4 bytes or None
+    
+    Output is piped from FFmpeg as fragmented MP4 rather than written to
+    disk and read back for upload.
+    
+    input_size_mb comes from the caller's stat of the download.
+    duration is taken from yt-dlp metadata when known, else probed.
+    Uses a hardware encoder when available. Otherwise files just over
+    the limit use single-pass CRF with a VBV cap, larger ones use
+    two-pass bitrate targeting
     """
     try:
         logger.info(f"Starting compression: {input_path}")
         
-        # Get video duration
-        duration = get_video_duration(input_path)
+        # Get video duration (probe only if yt-dlp didn't report it)
+        if not duration:
+            duration = await get_video_duration(input_path)
         if not duration:
             logger.error("Could not get video duration")
-            return False
+            return None
+        
+        # NVENC output runs larger than x264 at the same bitrate
+        if HW_ENCODER == 'h264_nvenc':
+            target_size_mb = min(target_size_mb, NVENC_TARGET_COMPRESSED_SIZE_MB)
         
         # Calculate target bitrate (in kbps)
         # Formula: (target_size_MB * 8192) / duration_seconds
@@ -93,46 +261,122 @@ def compress_video(input_path, output_path, target_size_mb):
         
         logger.info(f"Duration: {duration}s, Target bitrate: {video_bitrate}k")
         
-        # FFmpeg compression command
-        cmd = [
-            FFMPEG_PATH,
-            '-i', input_path,
-            '-c:v', 'libx264',  # H.264 codec
-            '-b:v', f'{video_bitrate}k',  # Video bitrate
-            '-maxrate', f'{video_bitrate}k',
-            '-bufsize', f'{video_bitrate * 2}k',
-            '-c:a', 'aac',  # Audio codec
-            '-b:a', f'{audio_bitrate}k',  # Audio bitrate
-            '-preset', 'fast',  # Encoding speed
-            '-movflags', '+faststart',  # Web optimization
-            '-y',  # Overwrite output
-            output_path
-        ]
+        passlog = None
         
-        # Run FFmpeg
-        logger.info(f"Running FFmpeg compression...")
-        result = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True,
-            timeout=600  # 10 minutes max
-        )
+        # +faststart needs a seekable output, fragmented MP4 can stream
+        output_args = [
+            '-f', 'mp4',
+            '-movflags', '+frag_keyframe+empty_moov',
+            'pipe:1'
+        ]
         
-        if result.returncode == 0:
-            # Check compressed file size
-            compressed_size = os.path.getsize(output_path) / (1024 * 1024)
-            logger.info(f"Compression successful! Size: {compressed_size:.2f} MB")
-            return True
+        if HW_ENCODER:
+            logger.info(f"Using hardware encoder: {HW_ENCODER}")
+            input_args, video_args = hw_encoder_args(HW_ENCODER, video_bitrate)
+            
+            commands = [[
+                FFMPEG_PATH,
+                '-y',
+                *input_args,
+                '-i', input_path,
+                *video_args,
+                '-c:a', 'aac',  # Audio codec
+                '-b:a', f'{audio_bitrate}k',  # Audio bitrate
+                *output_args
+            ]]
+        elif input_size_mb < 1.5 * TELEGRAM_FILE_LIMIT_MB:
+            # Slightly oversized: single-pass CRF keeps quality constant,
+            # VBV cap bounds the peak rate so the size stays near target
+            # Cap at the audio-reserved video bitrate so video + audio fit
+            bitrate_cap = video_bitrate
+            logger.info(f"Using CRF mode with {bitrate_cap}k cap")
+            
+            commands = [[
+                FFMPEG_PATH,
+                '-y',
+                '-i', input_path,
+                '-c:v', 'libx264',  # H.264 codec
+                '-crf', '26',
+                '-maxrate', f'{bitrate_cap}k',
+                '-bufsize', f'{bitrate_cap * 2}k',
+                '-preset', 'medium',
+                '-threads', str(FFMPEG_THREADS),
+                '-c:a', 'aac',  # Audio codec
+                '-b:a', f'{audio_bitrate}k',  # Audio bitrate
+                *output_args
+            ]]
         else:
-            logger.error(f"FFmpeg error: {result.stderr}")
-            return False
+            # Two-pass encoding: pass 1 builds the bit allocation map,
+            # pass 2 uses it to hit the target size accurately
+            # Random name: titles can contain glob characters like [ ]
+            passlog = os.path.join(DOWNLOAD_FOLDER, f"passlog_{uuid.uuid4().hex}")
             
-    except subprocess.TimeoutExpired:
+            pass1_cmd = [
+                FFMPEG_PATH,
+                '-y',
+                '-i', input_path,
+                '-c:v', 'libx264',  # H.264 codec
+                '-b:v', f'{video_bitrate}k',  # Video bitrate
+                '-pass', '1',
+                '-passlogfile', passlog,
+                '-preset', 'medium',
+                '-threads', str(FFMPEG_THREADS),
+                '-an',  # No audio in analysis pass
+                '-f', 'null',
+                os.devnull
+            ]
+            
+            pass2_cmd = [
+                FFMPEG_PATH,
+                '-y',
+                '-i', input_path,
+                '-c:v', 'libx264',
+                '-b:v', f'{video_bitrate}k',
+                '-pass', '2',
+                '-passlogfile', passlog,
+                '-preset', 'medium',
+                '-threads', str(FFMPEG_THREADS),
+                '-c:a', 'aac',  # Audio codec
+                '-b:a', f'{audio_bitrate}k',  # Audio bitrate
+                *output_args
+            ]
+            
+            commands = [pass1_cmd, pass2_cmd]
+        
+        try:
+            # Run FFmpeg, waiting for a free encode slot first
+            async with encode_semaphore:
+                for pass_num, cmd in enumerate(commands, start=1):
+                    logger.info(f"Running FFmpeg compression (pass {pass_num}/{len(commands)})...")
+                    returncode, output, stderr = await run_command(
+                        cmd,
+                        timeout=600,  # 10 minutes max
+                        text=False
+                    )
+                    
+                    if returncode != 0:
+                        logger.error(f"FFmpeg error (pass {pass_num}): {stderr}")
+                        return None
+        finally:
+            # Cleanup x264 pass log files
+            if passlog:
+                for log_file in glob.glob(glob.escape(passlog) + '*.log*'):
+                    try:
+                        os.remove(log_file)
+                    except OSError:
+                        pass
+        
+        # Output of the last pass is the compressed video
+        compressed_size = len(output) / (1024 * 1024)
+        logger.info(f"Compression successful! Size: {compressed_size:.2f} MB")
+        return output
+            
+    except asyncio.TimeoutError:
         logger.error("Compression timeout!")
-        return False
+        return None
     except Exception as e:
         logger.error(f"Compression error: {e}")
-        return False
+        return None
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -176,7 +420,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 def get_video_info(url):
-    """Get video information using yt-dlp"""
+    """
+    Get video information using yt-dlp
+    
+    Returns the unprocessed extractor result: no format has been selected
+    yet, so it can be cached and handed to process_ie_result for any quality
+    """
     ydl_opts = {
         'quiet': True,
         'no_warnings': True,
@@ -185,13 +434,27 @@ def get_video_info(url):
     
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+            info = ydl.extract_info(url, download=False, process=False)
             return info
     except Exception as e:
         logger.error(f"Error getting video info: {e}")
         return None
 
 
+def download_prefix(chat_id, message_id):
+    """Path prefix of every file yt-dlp writes for one quality selection"""
+    # Message id keeps concurrent downloads in the same chat apart
+    return os.path.join(DOWNLOAD_FOLDER, f"{chat_id}_{message_id}_")
+
+
+def _stat(path):
+    """Return os.stat result for path, or None if it doesn't exist"""
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
 def format_size(size_bytes):
     """Convert bytes to human readable format"""
     if not size_bytes:
@@ -209,17 +472,20 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     url = update.message.text.strip()
     chat_id = update.effective_chat.id
     
-    # Check YouTube URL
-    if 'youtube.com' not in url and 'youtu.be' not in url:
+    # Check and clean YouTube URL
+    match = YT_RE.search(url)
+    if match:
+        cleaned_url = f"https://www.youtube.com/watch?v={match.group(1)}"
+    elif 'youtube.com' in url or 'youtu.be' in url:
+        # Uncommon shapes (playlists, reordered params) take the slow path
+        cleaned_url = clean_youtube_url(url)
+    else:
         await update.message.reply_text(
             "❌ Please send a valid YouTube link!\n\n"
             "Example: https://www.youtube.com/watch?v=..."
         )
         return
     
-    # Clean URL
-    cleaned_url = clean_youtube_url(url)
-    
     # Processing message
     processing_msg = await update.message.reply_text(
         "⏳ *Processing...*\n\n"
@@ -229,7 +495,7 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     
     # Get video info
-    info = get_video_info(cleaned_url)
+    info = await asyncio.to_thread(get_video_info, cleaned_url)
     
     if not info:
         await processing_msg.edit_text(
@@ -242,7 +508,9 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_video_info[chat_id] = {
         'url': cleaned_url,
         'title': info.get('title', 'Unknown'),
-        'formats': info.get('formats', [])
+        'duration': info.get('duration'),
+        # Extraction result, reused so the download skips a second fetch
+        'info': {k: v for k, v in info.items() if k not in INFO_DROP_KEYS}
     }
     
     # Get video formats
@@ -321,11 +589,13 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
     
     chat_id = update.effective_chat.id
     
-    if chat_id not in user_video_info:
+    # Claim the session so a double tap or a newer link in the same chat
+    # can't be processed twice or have its entry removed under it
+    video_info = user_video_info.pop(chat_id, None)
+    if not video_info:
         await query.edit_message_text("❌ Session expired!")
         return
     
-    video_info = user_video_info[chat_id]
     url = video_info['url']
     title = video_info['title']
     quality_data = query.data.split('_')[1]
@@ -337,18 +607,31 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
         parse_mode='Markdown'
     )
     
+    # Everything written for this request, removed however we exit
+    paths_to_cleanup = set()
+    
     try:
         # Download video
-        file_path = await download_video_with_progress(url, quality_data, chat_id, query)
+        file_path, video_meta = await download_video_with_progress(
+            url, quality_data, chat_id, query, info=video_info.get('info')
+        )
+        if file_path:
+            paths_to_cleanup.add(file_path)
         
-        if not file_path or not os.path.exists(file_path):
+        # One stat call for both existence and size
+        st = _stat(file_path) if file_path else None
+        if st is None:
             await query.edit_message_text("❌ Download failed!")
             return
         
         # Get file size
-        file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
+        file_size_mb = st.st_size / (1024 * 1024)
         logger.info(f"Downloaded: {file_size_mb:.2f} MB")
         
+        # File path, or compressed bytes if compression ran. video_meta is
+        # sent along since fragmented MP4 has no duration in its moov box
+        media = file_path
+        
         # Check if compression needed
         if file_size_mb > TELEGRAM_FILE_LIMIT_MB:
             await query.edit_message_text(
@@ -359,18 +642,20 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
                 parse_mode='Markdown'
             )
             
-            # Compress video
-            compressed_path = file_path.rsplit('.', 1)[0] + '_compressed.mp4'
-            compression_success = compress_video(file_path, compressed_path, TARGET_COMPRESSED_SIZE_MB)
+            # Compress video (kept in memory, uploaded straight from the pipe)
+            compressed_data = await compress_video(
+                file_path, file_size_mb, TARGET_COMPRESSED_SIZE_MB,
+                duration=video_meta.get('duration') or video_info.get('duration')
+            )
             
-            if compression_success and os.path.exists(compressed_path):
-                # Use compressed file
-                compressed_size_mb = os.path.getsize(compressed_path) / (1024 * 1024)
+            if compressed_data:
+                # Use compressed video
+                compressed_size_mb = len(compressed_data) / (1024 * 1024)
                 logger.info(f"Compressed to: {compressed_size_mb:.2f} MB")
                 
                 # Delete original
-                os.remove(file_path)
-                file_path = compressed_path
+                Path(file_path).unlink(missing_ok=True)
+                media = compressed_data
                 file_size_mb = compressed_size_mb
                 
                 # Check if still too large
@@ -379,13 +664,9 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
                         f"⚠️ *Still Too Large*\n\n"
                         f"Compressed: {file_size_mb:.1f} MB\n"
                         f"Limit: {TELEGRAM_FILE_LIMIT_MB}MB\n\n"
-                        f"📁 Location:\n`{file_path}`\n\n"
                         f"Try lower quality.",
                         parse_mode='Markdown'
                     )
-                    # Cleanup
-                    os.remove(file_path)
-                    del user_video_info[chat_id]
                     return
             else:
                 # Compression failed
@@ -393,13 +674,9 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
                     f"❌ *Compression Failed*\n\n"
                     f"Size: {file_size_mb:.1f} MB\n"
                     f"Limit: {TELEGRAM_FILE_LIMIT_MB}MB\n\n"
-                    f"📁 Location:\n`{file_path}`\n\n"
                     f"Try lower quality.",
                     parse_mode='Markdown'
                 )
-                # Cleanup
-                os.remove(file_path)
-                del user_video_info[chat_id]
                 return
         
         # Upload to Telegram
@@ -409,24 +686,17 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
             parse_mode='Markdown'
         )
         
-        if quality_data == 'audio':
-            with open(file_path, 'rb') as audio_file:
-                await context.bot.send_audio(
-                    chat_id=chat_id,
-                    audio=audio_file,
-                    title=title,
-                    caption=f"🎵 {title}\n📊 {file_size_mb:.1f} MB",
-                    parse_mode='Markdown'
-                )
+        if helper_bots and file_size_mb > HELPER_UPLOAD_MIN_MB:
+            await upload_via_helper(
+                context.bot, chat_id, media, title, quality_data, file_size_mb, video_meta
+            )
         else:
-            with open(file_path, 'rb') as video_file:
-                await context.bot.send_video(
-                    chat_id=chat_id,
-                    video=video_file,
-                    caption=f"🎬 {title}\n📊 {file_size_mb:.1f} MB | 🎥 {quality_data}p",
-                    supports_streaming=True,
-                    parse_mode='Markdown'
-                )
+            await send_media(
+                context.bot, chat_id, media, title, quality_data, file_size_mb, video_meta
+            )
+        
+        # Free disk space as soon as the upload is done
+        Path(file_path).unlink(missing_ok=True)
         
         await query.edit_message_text(
             f"✅ *Success!*\n\n"
@@ -434,38 +704,162 @@ async def handle_quality_selection(update: Update, context: ContextTypes.DEFAULT
             parse_mode='Markdown'
         )
         
-        # Cleanup
-        os.remove(file_path)
-        del user_video_info[chat_id]
-        
     except Exception as e:
         logger.error(f"Error: {e}")
         await query.edit_message_text(f"❌ Error: {str(e)[:100]}")
+    finally:
+        # Cleanup, including .part and per-format files from failed downloads
+        prefix = download_prefix(chat_id, query.message.message_id)
+        paths_to_cleanup.update(glob.glob(glob.escape(prefix) + '*'))
+        for path in paths_to_cleanup:
+            Path(path).unlink(missing_ok=True)
+
+
+async def send_media(bot, chat_id, media, title, quality_data, file_size_mb, video_meta=None):
+    """
+    Upload a file path or in-memory video bytes as audio or video, return the sent message
+    
+    video_meta holds duration/width/height for videos whose container lacks them
+    """
+    if isinstance(media, bytes):
+        media_file = io.BytesIO(media)
+        media_file.name = f"{chat_id}_compressed.mp4"
+    else:
+        media_file = open(media, 'rb')
+    
+    # read_file_handle=False lets the upload stream from disk
+    # instead of loading the whole file into memory first
+    with media_file:
+        if quality_data == 'audio':
+            return await bot.send_audio(
+                chat_id=chat_id,
+                audio=InputFile(media_file, read_file_handle=False),
+                title=title,
+                caption=f"🎵 {title}\n📊 {file_size_mb:.1f} MB",
+                parse_mode='Markdown'
+            )
+        return await bot.send_video(
+            chat_id=chat_id,
+            video=InputFile(media_file, read_file_handle=False),
+            caption=f"🎬 {title}\n📊 {file_size_mb:.1f} MB | 🎥 {quality_data}p",
+            supports_streaming=True,
+            parse_mode='Markdown',
+            **(video_meta or {})
+        )
+
+
+async def upload_via_helper(bot, chat_id, media, title, quality_data, file_size_mb, video_meta=None):
+    """
+    Upload through the least busy helper bot to the dump chat, then copy to user
+    
+    Falls back to a direct upload by the main bot if the helper path fails
+    """
+    helper = min(helper_bots, key=lambda b: helper_loads[b.token])
+    helper_loads[helper.token] += 1
+    logger.info(f"Uploading via helper bot {helper_bots.index(helper)}")
+    
+    try:
+        message = await send_media(
+            helper, LEECH_DUMP_CHAT, media, title, quality_data, file_size_mb, video_meta
+        )
+        return await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=LEECH_DUMP_CHAT,
+            message_id=message.message_id
+        )
+    except Exception as e:
+        logger.warning(f"Helper upload failed, sending directly: {e}")
+    finally:
+        helper_loads[helper.token] -= 1
+    
+    return await send_media(bot, chat_id, media, title, quality_data, file_size_mb, video_meta)
+
+
+async def start_helper_bots(application):
+    """Initialize helper bots used for large uploads"""
+    if not HELPER_TOKENS:
+        return
+    if not LEECH_DUMP_CHAT:
+        logger.warning("HELPER_TOKENS set without LEECH_DUMP_CHAT, helper bots disabled")
+        return
+    
+    for token in HELPER_TOKENS:
+        # Same pool size ApplicationBuilder gives the main bot; the default
+        # single connection would time out concurrent uploads on one helper
+        helper = Bot(token, request=HTTPXRequest(connection_pool_size=256))
+        try:
+            await helper.initialize()
+        except Exception as e:
+            logger.error(f"Helper bot init failed: {e}")
+            continue
+        helper_bots.append(helper)
+        helper_loads[token] = 0
+    
+    logger.info(f"Helper bots ready: {len(helper_bots)}")
 
 
-async def download_video_with_progress(url, quality, chat_id, query):
-    """Download video with progress updates"""
-    output_template = os.path.join(DOWNLOAD_FOLDER, f"{chat_id}_%(title)s.%(ext)s")
-    progress_data = {'last_update': 0}
+async def stop_helper_bots(application):
+    """Shut down helper bots"""
+    for helper in helper_bots:
+        try:
+            await helper.shutdown()
+        except Exception as e:
+            logger.error(f"Helper bot shutdown failed: {e}")
+
+
+async def download_video_with_progress(url, quality, chat_id, query, info=None):
+    """
+    Download video with progress updates, reusing extracted info when given
+    
+    Returns (file path, {duration, width, height}) or (None, None)
+    """
+    output_template = download_prefix(chat_id, query.message.message_id) + "%(title)s.%(ext)s"
+    # At most one edit in flight, next one no sooner than 3s after it lands
+    progress_data = {'in_flight': False, 'next_ok_at': 0.0, 'last_percent': -1, 'future': None}
+    
+    # yt-dlp runs in a worker thread, so hooks must post back to this loop
+    main_loop = asyncio.get_running_loop()
+    
+    def on_progress_sent(future):
+        progress_data['next_ok_at'] = main_loop.time() + 3
+        progress_data['in_flight'] = False
+        
+        # Rate limits etc. on progress edits must not abort the download
+        if not future.cancelled() and future.exception():
+            logger.warning(f"Progress update failed: {future.exception()}")
     
     def progress_hook(d):
-        if d['status'] == 'downloading':
-            current_time = asyncio.get_event_loop().time()
-            if current_time - progress_data['last_update'] > 10:
-                progress_data['last_update'] = current_time
-                
-                downloaded = d.get('downloaded_bytes', 0)
-                total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-                
-                if total:
-                    percent = (downloaded / total) * 100
-                    progress_bar = "█" * int(percent / 5) + "░" * (20 - int(percent / 5))
-                    
-                    asyncio.create_task(query.edit_message_text(
-                        f"⏳ *Downloading...*\n\n"
-                        f"[{progress_bar}] {percent:.1f}%",
-                        parse_mode='Markdown'
-                    ))
+        if d['status'] != 'downloading':
+            return
+        if progress_data['in_flight'] or main_loop.time() < progress_data['next_ok_at']:
+            return
+        
+        downloaded = d.get('downloaded_bytes', 0)
+        total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
+        if not total:
+            return
+        
+        percent = (downloaded / total) * 100
+        
+        # Skip edits that wouldn't change the message
+        if int(percent) == progress_data['last_percent']:
+            return
+        progress_data['last_percent'] = int(percent)
+        
+        progress_bar = "█" * int(percent / 5) + "░" * (20 - int(percent / 5))
+        
+        progress_data['in_flight'] = True
+        try:
+            future = asyncio.run_coroutine_threadsafe(query.edit_message_text(
+                f"⏳ *Downloading...*\n\n"
+                f"[{progress_bar}] {percent:.1f}%",
+                parse_mode='Markdown'
+            ), main_loop)
+            future.add_done_callback(on_progress_sent)
+            progress_data['future'] = future
+        except Exception as e:
+            progress_data['in_flight'] = False
+            logger.warning(f"Progress update failed: {e}")
     
     if quality == 'audio':
         ydl_opts = {
@@ -481,27 +875,64 @@ async def download_video_with_progress(url, quality, chat_id, query):
             'no_warnings': True,
         }
     else:
+        # Prefer a progressive MP4 at the chosen height (no merge step),
+        # then MP4+M4A which merges by stream copy
         ydl_opts = {
-            'format': f'bestvideo[height<={quality}]+bestaudio/best[height<={quality}]',
+            'format': (
+                f'best[ext=mp4][height={quality}]'
+                f'/bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]'
+                f'/bestvideo[height<={quality}]+bestaudio'
+                f'/best[height<={quality}]'
+            ),
             'outtmpl': output_template,
             'merge_output_format': 'mp4',
+            # Non-MP4 fallbacks get a container-only remux, not a re-encode
+            'postprocessors': [{
+                'key': 'FFmpegVideoRemuxer',
+                'preferedformat': 'mp4',
+            }],
             'progress_hooks': [progress_hook],
             'quiet': True,
             'no_warnings': True,
         }
     
-    try:
+    def _run_download():
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            
-            if quality == 'audio':
-                filename = filename.rsplit('.', 1)[0] + '.mp3'
+            if info:
+                result = ydl.process_ie_result(info, download=True)
+            else:
+                result = ydl.extract_info(url, download=True)
+            # Postprocessors (remux, audio extraction) can change the extension
+            download = (result.get('requested_downloads') or [result])[0]
+            filename = download.get('filepath') or ydl.prepare_filename(result)
             
-            return filename
+            # Metadata for send_video, taken from yt-dlp rather than ffprobe
+            meta = {
+                'duration': download.get('duration') or result.get('duration'),
+                'width': download.get('width') or result.get('width'),
+                'height': download.get('height') or result.get('height'),
+            }
+            return filename, {k: int(v) for k, v in meta.items() if v}
+    
+    try:
+        filename, video_meta = await asyncio.to_thread(_run_download)
+        
+        if quality == 'audio':
+            filename = filename.rsplit('.', 1)[0] + '.mp3'
+        
+        return filename, video_meta
     except Exception as e:
         logger.error(f"Download error: {e}")
-        return None
+        return None, None
+    finally:
+        # Let the last progress edit land (or drop it) so it can't
+        # overwrite the status message that follows the download
+        future = progress_data['future']
+        if future and not future.done():
+            try:
+                await asyncio.wait_for(asyncio.wrap_future(future), timeout=5)
+            except Exception:
+                future.cancel()
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -509,9 +940,41 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Error: {context.error}")
 
 
+def sweep_downloads(max_age=3600):
+    """Delete leftover files in the download folder older than max_age seconds"""
+    cutoff = time.time() - max_age
+    removed = 0
+    
+    with os.scandir(DOWNLOAD_FOLDER) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except OSError as e:
+                logger.error(f"Sweep error on {entry.path}: {e}")
+    
+    if removed:
+        logger.info(f"Removed {removed} stale file(s) from downloads")
+
+
 def main():
     """Start bot"""
-    application = Application.builder().token(BOT_TOKEN).build()
+    global HW_ENCODER
+    sweep_downloads()
+    
+    HW_ENCODER = detect_hw_encoder()
+    logger.info(f"Video encoder: {HW_ENCODER or 'libx264'}")
+    
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        # Downloads and encodes take minutes, don't make other chats wait
+        .concurrent_updates(True)
+        .post_init(start_helper_bots)
+        .post_shutdown(stop_helper_bots)
+        .build()
+    )
     
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
@@ -520,7 +983,22 @@ def main():
     application.add_error_handler(error_handler)
     
     logger.info("🚀 Bot starting with compression support...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        # Without a secret anyone could POST fake updates to /webhook
+        logger.warning("WEBHOOK_URL set without WEBHOOK_SECRET, falling back to polling")
+    
+    if WEBHOOK_URL and WEBHOOK_SECRET:
+        logger.info(f"Using webhook on port {PORT}")
+        application.run_webhook(
+            listen='0.0.0.0',
+            port=PORT,
+            url_path='webhook',
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/webhook",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':